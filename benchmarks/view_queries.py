@@ -0,0 +1,85 @@
+"""Benchmark queries against the predefined database views and time ranges.
+
+Prints the execution plan and runtime of a query against each view, along
+with aggregate queries over short and long time ranges. Run the script before
+and after applying a schema migration to compare performance. Database
+connection settings are read from the same environmental variables used by
+the ``lmod-ingest`` utility.
+
+Usage:
+    python benchmarks/view_queries.py [--repeat N]
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from lmod_ingest.utils import fetch_db_url
+
+VIEWS = ('package_count', 'package_version_count', 'unique_loads')
+
+# Aggregate package loads over a time range, as done by typical reporting queries
+TIME_RANGE_QUERY = """
+    SELECT package, COUNT(*) AS total
+    FROM log_data
+    WHERE time >= :start AND time < :end
+    GROUP BY package
+"""
+
+# Fractions of the logged time span covered by each time range query
+TIME_RANGE_FRACTIONS = {'short time range': 0.001, 'long time range': 0.25}
+
+
+async def benchmark_query(connection, name: str, query: str, repeat: int, params: dict | None = None) -> None:
+    """Print the query plan and best runtime for a query
+
+    Args:
+        connection: An open database connection
+        name: Name used to label the benchmark output
+        query: The SQL query to benchmark
+        repeat: Number of times to execute the query
+        params: Bound parameter values for the query
+    """
+
+    plan = await connection.execute(sa.text(f'EXPLAIN (ANALYZE, BUFFERS) {query}'), params)
+    print(f'=== {name} ===')
+    print('\n'.join(row[0] for row in plan))
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await connection.execute(sa.text(query), params)
+        timings.append(time.perf_counter() - start)
+
+    print(f'Best of {repeat}: {min(timings) * 1000:.1f} ms\n')
+
+
+async def run_benchmarks(repeat: int) -> None:
+    """Benchmark queries against each predefined view and over multiple time ranges
+
+    Args:
+        repeat: Number of times to execute each query
+    """
+
+    db_engine = create_async_engine(url=fetch_db_url())
+    async with db_engine.connect() as connection:
+        for view in VIEWS:
+            await benchmark_query(connection, view, f'SELECT * FROM {view}', repeat)
+
+        # Time ranges start in the middle of the logged time span
+        first, last = (await connection.execute(sa.text('SELECT min(time), max(time) FROM log_data'))).one()
+        for name, fraction in TIME_RANGE_FRACTIONS.items():
+            start = first + (last - first) / 2
+            params = {'start': start, 'end': start + (last - first) * fraction}
+            await benchmark_query(connection, name, TIME_RANGE_QUERY, repeat, params)
+
+    await db_engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark queries against the predefined database views and time ranges')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times to execute each query')
+    asyncio.run(run_benchmarks(parser.parse_args().repeat))
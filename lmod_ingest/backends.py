@@ -0,0 +1,561 @@
+"""Storage backends for persisting and querying ingested log data.
+
+Two backends are available: a PostgreSQL backend intended for production
+deployments and an embedded DuckDB backend intended for small sites, local
+analysis, and testing. The active backend is selected using the ``DB_BACKEND``
+environmental variable.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+from alembic import command, config
+
+from . import utils
+from .sketches import HyperLogLog, build_sketches
+from .views import PACKAGE_COUNT_0_2, PACKAGE_VERSION_COUNT_0_2, UNIQUE_LOADS_0_5
+
+# Database metadata
+CURRENT_SCHEMA_VERSION = '0.5'
+MIGRATIONS_DIR = Path(__file__).resolve().parent / 'migrations'
+
+# Default batch settings for online data migrations
+DEFAULT_BATCH_SIZE = 50_000
+DEFAULT_BATCH_DELAY = 0.1
+
+# Columns of the ``log_data`` table populated during ingestion
+LOG_COLUMNS = ('logname', 'time', 'host', 'user', 'module', 'path', 'package', 'version', 'jobid')
+
+# Table used to record the schema version of DuckDB databases
+DUCKDB_VERSION_TABLE = 'schema_version'
+
+# Incremental DuckDB schema changes keyed by the schema version they upgrade to, in order of application.
+# The DuckDB backend was introduced with schema version 0.5, which is equivalent to the current Postgres schema.
+# Views are shared with the Alembic migrations, and tables are checked against the Alembic head by the test suite.
+DUCKDB_MIGRATIONS = {
+    '0.5': (
+        """
+        CREATE SEQUENCE log_data_id_seq;
+        """,
+        """
+        CREATE TABLE log_data (
+            id INTEGER PRIMARY KEY DEFAULT nextval('log_data_id_seq'),
+            logname VARCHAR(4096) NOT NULL,
+            time TIMESTAMP NOT NULL,
+            host VARCHAR(255) NOT NULL,
+            "user" VARCHAR(50) NOT NULL,
+            module VARCHAR(100) NOT NULL,
+            path VARCHAR(4096) NOT NULL,
+            package VARCHAR(100) NOT NULL,
+            version VARCHAR(150),
+            jobid BIGINT,
+            CONSTRAINT unq_log_entry UNIQUE (time, host, "user", module)
+        );
+        """,
+        """
+        CREATE SEQUENCE load_sketches_id_seq;
+        """,
+        # DuckDB treats nulls as distinct in unique constraints (and does not support ``NULLS NOT DISTINCT``),
+        # so sketches for unversioned packages are matched using ``IS NOT DISTINCT FROM`` during ingestion
+        """
+        CREATE TABLE load_sketches (
+            id INTEGER PRIMARY KEY DEFAULT nextval('load_sketches_id_seq'),
+            package VARCHAR(100) NOT NULL,
+            version VARCHAR(150),
+            day DATE NOT NULL,
+            users BLOB NOT NULL,
+            jobs BLOB NOT NULL,
+            CONSTRAINT unq_load_sketch UNIQUE (package, version, day)
+        );
+        """,
+        f"CREATE VIEW unique_loads AS {UNIQUE_LOADS_0_5};",
+        f"CREATE VIEW package_count AS {PACKAGE_COUNT_0_2};",
+        f"CREATE VIEW package_version_count AS {PACKAGE_VERSION_COUNT_0_2};",
+    ),
+}
+
+
+class Backend(ABC):
+    """Abstract interface for a database storage backend"""
+
+    @abstractmethod
+    def migrate(
+        self, sql: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY
+    ) -> None:
+        """Migrate the database to the current schema version
+
+        Args:
+            sql: Print SQL migration commands without executing them
+            batch_size: Number of records to modify per batch when backfilling data
+            batch_delay: Seconds to wait between batches when backfilling data
+        """
+
+    @abstractmethod
+    def ingest_file(self, path: Path) -> None:
+        """Ingest a log file into the database
+
+        Args:
+            path: The log file path
+        """
+
+    @abstractmethod
+    def rebuild_sketches(self, batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY) -> None:
+        """Build distinct count sketches from the log data already stored in the database
+
+        Args:
+            batch_size: Number of records to read per batch
+            batch_delay: Seconds to wait between batches
+        """
+
+    @abstractmethod
+    def count(
+        self,
+        package: str,
+        version: str | None = None,
+        start: date | None = None,
+        end: date | None = None,
+        exact: bool = False
+    ) -> dict[str, int]:
+        """Count the distinct users and Slurm jobs that loaded a package
+
+        Args:
+            package: The package name
+            version: Optionally limit counts to a single package version
+            start: Optionally limit counts to records on or after the given date
+            end: Optionally limit counts to records before the given date
+            exact: Calculate exact counts from the raw log data instead of estimates
+
+        Returns:
+            A dictionary with the distinct ``users`` and ``jobs`` counts
+        """
+
+
+class PostgresBackend(Backend):
+    """Storage backend for a PostgreSQL server"""
+
+    def __init__(self, url: str) -> None:
+        """Create a new backend instance
+
+        Args:
+            url: A SQLAlchemy compatible database URL
+        """
+
+        self.url = url
+
+    def alembic_config(
+        self, batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY
+    ) -> config.Config:
+        """Return the Alembic configuration used to migrate the database
+
+        Args:
+            batch_size: Number of records to modify per batch when backfilling data
+            batch_delay: Seconds to wait between batches when backfilling data
+
+        Returns:
+            An Alembic configuration object
+        """
+
+        alembic_cfg = config.Config()
+        alembic_cfg.set_main_option('script_location', str(MIGRATIONS_DIR))
+        alembic_cfg.set_main_option('sqlalchemy.url', self.url)
+        alembic_cfg.set_main_option('batch_size', str(batch_size))
+        alembic_cfg.set_main_option('batch_delay', str(batch_delay))
+        return alembic_cfg
+
+    def migrate(
+        self, sql: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY
+    ) -> None:
+        """Migrate the database to the current schema version
+
+        Args:
+            sql: Print SQL migration commands without executing them
+            batch_size: Number of records to modify per batch when backfilling data
+            batch_delay: Seconds to wait between batches when backfilling data
+        """
+
+        alembic_cfg = self.alembic_config(batch_size, batch_delay)
+        command.upgrade(alembic_cfg, revision=CURRENT_SCHEMA_VERSION, sql=sql)
+
+    def ingest_file(self, path: Path) -> None:
+        """Ingest a log file into the database
+
+        Args:
+            path: The log file path
+        """
+
+        asyncio.run(utils.ingest_file(path, self.url))
+
+    def rebuild_sketches(self, batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY) -> None:
+        """Build distinct count sketches from the log data already stored in the database
+
+        Args:
+            batch_size: Number of records to read per batch
+            batch_delay: Seconds to wait between batches
+        """
+
+        asyncio.run(utils.rebuild_sketches(self.url, batch_size, batch_delay))
+
+    def count(
+        self,
+        package: str,
+        version: str | None = None,
+        start: date | None = None,
+        end: date | None = None,
+        exact: bool = False
+    ) -> dict[str, int]:
+        """Count the distinct users and Slurm jobs that loaded a package
+
+        Args:
+            package: The package name
+            version: Optionally limit counts to a single package version
+            start: Optionally limit counts to records on or after the given date
+            end: Optionally limit counts to records before the given date
+            exact: Calculate exact counts from the raw log data instead of estimates
+
+        Returns:
+            A dictionary with the distinct ``users`` and ``jobs`` counts
+        """
+
+        return asyncio.run(utils.count_package(self.url, package, version, start, end, exact))
+
+
+class DuckDBBackend(Backend):
+    """Storage backend for an embedded DuckDB database file"""
+
+    def __init__(self, path: Path | str) -> None:
+        """Create a new backend instance
+
+        Args:
+            path: Path of the database file, or ``:memory:`` for an in-memory database
+
+        Raises:
+            RuntimeError: If the ``duckdb`` package is not installed
+        """
+
+        try:
+            import duckdb
+
+        except ImportError as excep:  # pragma: nocover
+            raise RuntimeError('The DuckDB backend requires the `duckdb` package to be installed') from excep
+
+        self.connection = duckdb.connect(str(path))
+
+    def schema_version(self) -> str | None:
+        """Return the schema version recorded in the database
+
+        Returns:
+            The schema version, or ``None`` if the database has not been versioned
+        """
+
+        version_table = self.connection.execute(
+            'SELECT table_name FROM duckdb_tables() WHERE table_name = ?', [DUCKDB_VERSION_TABLE]
+        ).fetchone()
+
+        if version_table is None:
+            return None
+
+        version = self.connection.execute(f'SELECT version FROM {DUCKDB_VERSION_TABLE}').fetchone()
+        return None if version is None else version[0]
+
+    def verify_schema(self) -> None:
+        """Verify the database schema matches the current schema version
+
+        Raises:
+            RuntimeError: If the database schema version does not match the current schema version
+        """
+
+        version = self.schema_version()
+        if version != CURRENT_SCHEMA_VERSION:
+            raise RuntimeError(
+                f'Database schema version {version} does not match the expected version {CURRENT_SCHEMA_VERSION}. '
+                f'Run `lmod-ingest migrate` to update the database schema.'
+            )
+
+    def migrate(
+        self, sql: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY
+    ) -> None:
+        """Migrate the database to the current schema version
+
+        Schema changes are applied in place, so the batch settings are ignored.
+
+        Args:
+            sql: Print SQL migration commands without executing them
+            batch_size: Unused by this backend
+            batch_delay: Unused by this backend
+
+        Raises:
+            RuntimeError: If the database schema version is not recognized
+        """
+
+        version = self.schema_version()
+        versions = list(DUCKDB_MIGRATIONS)
+        if version is None:
+            existing_tables = self.connection.execute('SELECT COUNT(*) FROM duckdb_tables()').fetchone()[0]
+            if existing_tables:
+                raise RuntimeError('Database is not empty and has no recorded schema version')
+
+            pending = versions
+
+        elif version in versions:
+            pending = versions[versions.index(version) + 1:]
+
+        else:
+            raise RuntimeError(f'Database schema version {version} is not supported by this version of lmod-ingest')
+
+        if not pending:
+            logging.info(f'Database schema is already at version {version}')
+            return
+
+        statements = [f'CREATE TABLE IF NOT EXISTS {DUCKDB_VERSION_TABLE} (version VARCHAR NOT NULL);']
+        for new_version in pending:
+            statements.extend(DUCKDB_MIGRATIONS[new_version])
+            statements.append(f'DELETE FROM {DUCKDB_VERSION_TABLE};')
+            statements.append(f"INSERT INTO {DUCKDB_VERSION_TABLE} (version) VALUES ('{new_version}');")
+
+        if sql:
+            print('\n'.join(statements))
+            return
+
+        # Apply all schema changes atomically so a failed migration leaves the database unchanged
+        self.connection.begin()
+        try:
+            for statement in statements:
+                self.connection.execute(statement)
+
+            self.connection.commit()
+
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def ingest_data(self, data: pd.DataFrame) -> None:
+        """Ingest parsed log data into the database
+
+        Records already present in the database are ignored.
+
+        Args:
+            data: Log data following the same data model as the ``log_data`` table
+        """
+
+        if data.empty:
+            return
+
+        # Pandas timestamps have nanosecond precision and are explicitly cast to
+        # match the column type, otherwise DuckDB will not detect conflicting records
+        columns = ', '.join(f'"{column}"' for column in LOG_COLUMNS)
+        values = columns.replace('"time"', '"time"::TIMESTAMP')
+
+        self.connection.register('incoming_logs', data)
+        try:
+            # Duplicates are resolved in a single vectorized statement against the unique key
+            self.connection.execute(
+                f'INSERT INTO log_data ({columns}) SELECT {values} FROM incoming_logs ON CONFLICT DO NOTHING'
+            )
+
+        finally:
+            self.connection.unregister('incoming_logs')
+
+    def ingest_sketches(self, data: pd.DataFrame) -> None:
+        """Merge parsed log data into the distinct count sketches stored in the database
+
+        Args:
+            data: Log data following the same data model as the ``log_data`` table
+        """
+
+        if data.empty:
+            return
+
+        sketches = build_sketches(data)
+        incoming = pd.DataFrame(
+            [(s['package'], s['version'], s['day']) for s in sketches],
+            columns=['package', 'version', 'day']
+        )
+
+        # Null versions are matched explicitly since they never conflict with the unique constraint
+        match_sketch = 's.package = i.package AND s.version IS NOT DISTINCT FROM i.version AND s.day = i.day'
+        self.connection.register('incoming_sketches', incoming)
+        try:
+            self.connection.begin()
+            stored = self.connection.execute(f"""
+                SELECT s.package, s.version, s.day, s.users, s.jobs
+                FROM load_sketches s JOIN incoming_sketches i ON {match_sketch}
+            """).fetchall()
+
+            stored = {(package, version, day): (users, jobs) for package, version, day, users, jobs in stored}
+            for sketch in sketches:
+                if (match := stored.get((sketch['package'], sketch['version'], sketch['day']))) is not None:
+                    sketch['users'].merge(HyperLogLog.from_bytes(match[0]))
+                    sketch['jobs'].merge(HyperLogLog.from_bytes(match[1]))
+
+            merged = incoming.assign(
+                users=[sketch['users'].to_bytes() for sketch in sketches],
+                jobs=[sketch['jobs'].to_bytes() for sketch in sketches]
+            )
+
+            # Update existing sketches and insert new ones, each in a single vectorized statement
+            self.connection.register('merged_sketches', merged)
+            self.connection.execute(f"""
+                UPDATE load_sketches s SET users = i.users, jobs = i.jobs
+                FROM merged_sketches i WHERE {match_sketch}
+            """)
+            self.connection.execute(f"""
+                INSERT INTO load_sketches (package, version, day, users, jobs)
+                SELECT i.package, i.version, i.day, i.users, i.jobs FROM merged_sketches i
+                WHERE NOT EXISTS (SELECT 1 FROM load_sketches s WHERE {match_sketch})
+            """)
+            self.connection.commit()
+
+        except Exception:
+            self.connection.rollback()
+            raise
+
+        finally:
+            self.connection.unregister('incoming_sketches')
+            self.connection.unregister('merged_sketches')
+
+    def ingest_file(self, path: Path) -> None:
+        """Ingest a log file into the database
+
+        Args:
+            path: The log file path
+
+        Raises:
+            RuntimeError: If the database schema is not up to date
+        """
+
+        self.verify_schema()
+        logging.info(f'Ingesting {path.resolve()}')
+        logging.info(f'Parsing log data')
+        data = utils.parse_log_data(path)
+
+        logging.info(f'Loading data into database')
+        start = time.time()
+        self.ingest_data(data)
+        logging.info(f'Ingested {len(data)} log entries in {time.time() - start:.2f} seconds')
+
+        logging.info(f'Updating distinct count sketches')
+        start = time.time()
+        self.ingest_sketches(data)
+        logging.info(f'Updated sketches in {time.time() - start:.2f} seconds')
+
+    def rebuild_sketches(self, batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY) -> None:
+        """Build distinct count sketches from the log data already stored in the database
+
+        Records are merged into the stored sketches in batches over ranges of the
+        ``id`` column, so the rebuild can be safely repeated.
+
+        Args:
+            batch_size: Number of records to read per batch
+            batch_delay: Seconds to wait between batches
+
+        Raises:
+            RuntimeError: If the database schema is not up to date
+        """
+
+        self.verify_schema()
+        min_key, max_key = self.connection.execute('SELECT min(id), max(id) FROM log_data').fetchone()
+        if min_key is None:
+            return
+
+        logging.info(f'Building sketches from log_data records {min_key} through {max_key}')
+        start = time.time()
+        total_keys = max_key - min_key + 1
+        for lower in range(min_key, max_key + 1, batch_size):
+            upper = lower + batch_size
+            data = self.connection.execute(
+                'SELECT time, "user", package, version, jobid FROM log_data WHERE id >= ? AND id < ?', [lower, upper]
+            ).df()
+
+            self.ingest_sketches(data)
+            progress = min(upper - min_key, total_keys) / total_keys
+            logging.info(f'Built sketches: {progress:.1%} complete ({time.time() - start:.0f} seconds)')
+            time.sleep(batch_delay)
+
+    def count(
+        self,
+        package: str,
+        version: str | None = None,
+        start: date | None = None,
+        end: date | None = None,
+        exact: bool = False
+    ) -> dict[str, int]:
+        """Count the distinct users and Slurm jobs that loaded a package
+
+        Args:
+            package: The package name
+            version: Optionally limit counts to a single package version
+            start: Optionally limit counts to records on or after the given date
+            end: Optionally limit counts to records before the given date
+            exact: Calculate exact counts from the raw log data instead of estimates
+
+        Returns:
+            A dictionary with the distinct ``users`` and ``jobs`` counts
+
+        Raises:
+            RuntimeError: If the database schema is not up to date
+        """
+
+        self.verify_schema()
+        time_column = 'time' if exact else 'day'
+        conditions, params = ['package = ?'], [package]
+        if version is not None:
+            conditions.append('version = ?')
+            params.append(version)
+
+        if start is not None:
+            conditions.append(f'{time_column} >= ?')
+            params.append(start)
+
+        if end is not None:
+            conditions.append(f'{time_column} < ?')
+            params.append(end)
+
+        where = ' AND '.join(conditions)
+        if exact:
+            users, jobs = self.connection.execute(
+                f'SELECT COUNT(DISTINCT "user"), COUNT(DISTINCT jobid) FROM log_data WHERE {where}', params
+            ).fetchone()
+
+            return {'users': users, 'jobs': jobs}
+
+        users, jobs = HyperLogLog(), HyperLogLog()
+        for user_sketch, job_sketch in self.connection.execute(
+            f'SELECT users, jobs FROM load_sketches WHERE {where}', params
+        ).fetchall():
+            users.merge(HyperLogLog.from_bytes(user_sketch))
+            jobs.merge(HyperLogLog.from_bytes(job_sketch))
+
+        return {'users': users.estimate(), 'jobs': jobs.estimate()}
+
+
+def fetch_backend() -> Backend:
+    """Create a storage backend from settings defined in environment variables
+
+    The backend type is set by ``DB_BACKEND`` and defaults to ``postgres``.
+    DuckDB databases are stored at the file path given by ``DB_PATH``.
+
+    Returns:
+        A storage backend instance
+
+    Raises:
+        ValueError: If the backend type is not recognized or required settings are missing
+    """
+
+    backend = os.getenv('DB_BACKEND', default='postgres').lower()
+    if backend == 'postgres':
+        return PostgresBackend(utils.fetch_db_url())
+
+    if backend == 'duckdb':
+        db_path = os.getenv('DB_PATH')
+        if not db_path:
+            raise ValueError('DB_PATH must be configured as an environmental variable when using the DuckDB backend')
+
+        return DuckDBBackend(db_path)
+
+    raise ValueError(f'Unknown database backend "{backend}". Valid options are "postgres" and "duckdb".')
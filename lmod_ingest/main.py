@@ -1,17 +1,63 @@
 """Top level application logic for handling command line parsing and data ingestion."""
 
-import asyncio
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
+from datetime import date
 from pathlib import Path
 
-from alembic import config, command
 from dotenv import load_dotenv
 
-from . import utils, __version__
+from . import __version__
+from .backends import DEFAULT_BATCH_DELAY, DEFAULT_BATCH_SIZE, fetch_backend
 
-# Database metadata
-CURRENT_SCHEMA_VERSION = '0.2'
-MIGRATIONS_DIR = Path(__file__).resolve().parent / 'migrations'
+
+def positive_int(value: str) -> int:
+    """Parse a command line argument as an integer greater than zero
+
+    Args:
+        value: The argument value
+
+    Returns:
+        The parsed integer
+
+    Raises:
+        ArgumentTypeError: If the value is not a positive integer
+    """
+
+    try:
+        number = int(value)
+
+    except ValueError:
+        raise ArgumentTypeError(f'invalid integer value: {value!r}')
+
+    if number < 1:
+        raise ArgumentTypeError(f'value must be at least 1: {value!r}')
+
+    return number
+
+
+def non_negative_float(value: str) -> float:
+    """Parse a command line argument as a float greater than or equal to zero
+
+    Args:
+        value: The argument value
+
+    Returns:
+        The parsed float
+
+    Raises:
+        ArgumentTypeError: If the value is not a non-negative number
+    """
+
+    try:
+        number = float(value)
+
+    except ValueError:
+        raise ArgumentTypeError(f'invalid float value: {value!r}')
+
+    if number < 0:
+        raise ArgumentTypeError(f'value cannot be negative: {value!r}')
+
+    return number
 
 
 def ingest(path: Path) -> None:
@@ -21,22 +67,52 @@ def ingest(path: Path) -> None:
         path: Path of the log file
     """
 
-    db_url = utils.fetch_db_url()
-    asyncio.run(utils.ingest_file(path, db_url))
+    fetch_backend().ingest_file(path)
+
+
+def count(
+    package: str,
+    version: str | None = None,
+    start: date | None = None,
+    end: date | None = None,
+    exact: bool = False
+) -> None:
+    """Print the number of distinct users and Slurm jobs that loaded a package
 
+    Args:
+        package: The package name
+        version: Optionally limit counts to a single package version
+        start: Optionally limit counts to records on or after the given date
+        end: Optionally limit counts to records before the given date
+        exact: Calculate exact counts from the raw log data instead of estimates
+    """
 
-def migrate(sql: bool = False) -> None:
+    counts = fetch_backend().count(package, version, start, end, exact)
+    print(f'Distinct users: {counts["users"]}')
+    print(f'Distinct jobs: {counts["jobs"]}')
+
+
+def migrate(sql: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY) -> None:
     """Migrate the application database to the current schema version
 
     Args:
         sql: Print SQL migration commands without executing them
+        batch_size: Number of records to modify per batch when backfilling data
+        batch_delay: Seconds to wait between batches when backfilling data
     """
 
-    alembic_cfg = config.Config()
-    alembic_cfg.set_main_option('script_location', str(MIGRATIONS_DIR))
-    alembic_cfg.set_main_option('sqlalchemy.url', utils.fetch_db_url())
+    fetch_backend().migrate(sql, batch_size, batch_delay)
+
 
-    command.upgrade(alembic_cfg, revision=CURRENT_SCHEMA_VERSION, sql=sql)
+def rebuild_sketches(batch_size: int = DEFAULT_BATCH_SIZE, batch_delay: float = DEFAULT_BATCH_DELAY) -> None:
+    """Build distinct count sketches from the log data already stored in the application database
+
+    Args:
+        batch_size: Number of records to read per batch
+        batch_delay: Seconds to wait between batches
+    """
+
+    fetch_backend().rebuild_sketches(batch_size, batch_delay)
 
 
 def create_parser() -> ArgumentParser:
@@ -54,9 +130,24 @@ def create_parser() -> ArgumentParser:
     ingest_parser.set_defaults(callable=ingest)
     ingest_parser.add_argument('path', type=Path, help='log path to ingest data from')
 
+    count_parser = subparsers.add_parser('count')
+    count_parser.set_defaults(callable=count)
+    count_parser.add_argument('package', help='name of the package to count loads for')
+    count_parser.add_argument('--version', dest='version', help='only count loads of the given package version')
+    count_parser.add_argument('--start', type=date.fromisoformat, help='only count loads on or after this date (YYYY-MM-DD)')
+    count_parser.add_argument('--end', type=date.fromisoformat, help='only count loads before this date (YYYY-MM-DD)')
+    count_parser.add_argument('--exact', action='store_true', help='calculate exact counts instead of fast estimates')
+
     migrate_parser = subparsers.add_parser('migrate')
     migrate_parser.set_defaults(callable=migrate)
     migrate_parser.add_argument('--sql', action='store_true', help='display migration SQL but do not execute it')
+    migrate_parser.add_argument('--batch-size', type=positive_int, default=DEFAULT_BATCH_SIZE, help='records modified per batch when backfilling data')
+    migrate_parser.add_argument('--batch-delay', type=non_negative_float, default=DEFAULT_BATCH_DELAY, help='seconds to wait between backfill batches')
+
+    rebuild_parser = subparsers.add_parser('rebuild-sketches')
+    rebuild_parser.set_defaults(callable=rebuild_sketches)
+    rebuild_parser.add_argument('--batch-size', type=positive_int, default=DEFAULT_BATCH_SIZE, help='records read per batch')
+    rebuild_parser.add_argument('--batch-delay', type=non_negative_float, default=DEFAULT_BATCH_DELAY, help='seconds to wait between batches')
     return parser
 
 
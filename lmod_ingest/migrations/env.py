@@ -1,16 +1,326 @@
 """Environment configuration file and entrypoint for the ``alembic`` utility."""
 
 import asyncio
+import logging
+import time
 
+import sqlalchemy as sa
 from alembic import context
+from alembic.operations import MigrateOperation, Operations
 from sqlalchemy import pool
 from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 
+from lmod_ingest.backends import DEFAULT_BATCH_DELAY, DEFAULT_BATCH_SIZE
+
 # This is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# Default settings for acquiring table locks without blocking concurrent queries
+DEFAULT_LOCK_TIMEOUT = '2s'
+DEFAULT_LOCK_ATTEMPTS = 10
+
+
+@Operations.register_operation('create_index_concurrently')
+class CreateIndexConcurrentlyOp(MigrateOperation):
+    """Build an index without blocking concurrent writes to the indexed table
+
+    Concurrent index builds cannot run inside a transaction block, so the
+    index is created in autocommit mode. Any migrations preceding the
+    operation are committed before the index build begins.
+    """
+
+    def __init__(self, index_name: str, table_name: str, columns: list[str], **kwargs) -> None:
+        """Define a new concurrent index build
+
+        Args:
+            index_name: Name of the index to create
+            table_name: Name of the table to index
+            columns: Columns or SQL expressions to include in the index
+            **kwargs: Additional dialect arguments passed to ``op.create_index``
+        """
+
+        self.index_name = index_name
+        self.table_name = table_name
+        self.columns = columns
+        self.kwargs = kwargs
+
+    @classmethod
+    def create_index_concurrently(
+        cls, operations: Operations, index_name: str, table_name: str, columns: list[str], **kwargs
+    ) -> None:
+        """Issue a ``CREATE INDEX CONCURRENTLY`` statement"""
+
+        return operations.invoke(cls(index_name, table_name, columns, **kwargs))
+
+
+@Operations.register_operation('drop_index_concurrently')
+class DropIndexConcurrentlyOp(MigrateOperation):
+    """Drop an index without blocking concurrent access to the indexed table"""
+
+    def __init__(self, index_name: str, table_name: str) -> None:
+        """Define a new concurrent index removal
+
+        Args:
+            index_name: Name of the index to drop
+            table_name: Name of the indexed table
+        """
+
+        self.index_name = index_name
+        self.table_name = table_name
+
+    @classmethod
+    def drop_index_concurrently(cls, operations: Operations, index_name: str, table_name: str) -> None:
+        """Issue a ``DROP INDEX CONCURRENTLY`` statement"""
+
+        return operations.invoke(cls(index_name, table_name))
+
+
+@Operations.register_operation('backfill_column')
+class BackfillColumnOp(MigrateOperation):
+    """Populate a column in small, throttled batches over a range of key values
+
+    Each batch is committed independently so row locks are only held for the
+    duration of a single batch, allowing ongoing ingestion to proceed while
+    the backfill is in progress.
+    """
+
+    def __init__(self, table_name: str, column_name: str, expression: str, key: str = 'id') -> None:
+        """Define a new column backfill
+
+        Args:
+            table_name: Name of the table to update
+            column_name: Name of the column to populate
+            expression: SQL expression used to compute the column value
+            key: Name of the integer key column used to split records into batches
+        """
+
+        self.table_name = table_name
+        self.column_name = column_name
+        self.expression = expression
+        self.key = key
+
+    @classmethod
+    def backfill_column(
+        cls, operations: Operations, table_name: str, column_name: str, expression: str, key: str = 'id'
+    ) -> None:
+        """Issue a series of batched ``UPDATE`` statements"""
+
+        return operations.invoke(cls(table_name, column_name, expression, key))
+
+
+@Operations.register_operation('execute_with_lock_retry')
+class ExecuteWithLockRetryOp(MigrateOperation):
+    """Execute a statement requiring table locks without queueing behind long-running queries
+
+    A statement waiting on a table lock blocks every later query needing a
+    conflicting lock on the same table, including ongoing ingestion. The
+    statement is instead attempted with a short lock timeout and retried
+    with exponential backoff until the lock is acquired.
+    """
+
+    def __init__(self, sql: str, lock_timeout: str = DEFAULT_LOCK_TIMEOUT, attempts: int = DEFAULT_LOCK_ATTEMPTS) -> None:
+        """Define a new statement execution
+
+        Args:
+            sql: The SQL statement to execute
+            lock_timeout: Maximum time to wait for locks on each attempt
+            attempts: Maximum number of attempts before giving up
+        """
+
+        self.sql = sql
+        self.lock_timeout = lock_timeout
+        self.attempts = attempts
+
+    @classmethod
+    def execute_with_lock_retry(
+        cls,
+        operations: Operations,
+        sql: str,
+        lock_timeout: str = DEFAULT_LOCK_TIMEOUT,
+        attempts: int = DEFAULT_LOCK_ATTEMPTS
+    ) -> None:
+        """Issue a statement that is retried when its locks cannot be acquired"""
+
+        return operations.invoke(cls(sql, lock_timeout, attempts))
+
+
+@Operations.implementation_for(CreateIndexConcurrentlyOp)
+def create_index_concurrently(operations: Operations, operation: CreateIndexConcurrentlyOp) -> None:
+    """Build an index concurrently from outside a transaction block
+
+    A failed or cancelled concurrent build leaves behind an invalid index that
+    the query planner ignores. Invalid indexes from earlier attempts are
+    dropped and rebuilt, while valid indexes are left in place.
+
+    Args:
+        operations: The Alembic operations object
+        operation: The operation to execute
+    """
+
+    with operations.get_context().autocommit_block():
+        if not context.is_offline_mode():
+            is_valid = operations.get_bind().execute(
+                sa.text(
+                    'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                    'WHERE c.oid = to_regclass(:index_name)'
+                ),
+                {'index_name': operation.index_name}
+            ).scalar_one_or_none()
+
+            if is_valid:
+                logging.info(f'Index {operation.index_name} already exists')
+                return
+
+            if is_valid is False:
+                logging.warning(f'Dropping invalid index {operation.index_name} left by a previous build')
+                operations.drop_index(operation.index_name, operation.table_name, postgresql_concurrently=True)
+
+        logging.info(f'Building index {operation.index_name} on {operation.table_name}')
+        start = time.time()
+        operations.create_index(
+            operation.index_name,
+            operation.table_name,
+            operation.columns,
+            postgresql_concurrently=True,
+            **operation.kwargs
+        )
+
+    logging.info(f'Built index {operation.index_name} in {time.time() - start:.2f} seconds')
+
+
+@Operations.implementation_for(DropIndexConcurrentlyOp)
+def drop_index_concurrently(operations: Operations, operation: DropIndexConcurrentlyOp) -> None:
+    """Drop an index concurrently from outside a transaction block
+
+    Args:
+        operations: The Alembic operations object
+        operation: The operation to execute
+    """
+
+    with operations.get_context().autocommit_block():
+        operations.drop_index(
+            operation.index_name,
+            operation.table_name,
+            postgresql_concurrently=True,
+            if_exists=True
+        )
+
+
+@Operations.implementation_for(ExecuteWithLockRetryOp)
+def execute_with_lock_retry(operations: Operations, operation: ExecuteWithLockRetryOp) -> None:
+    """Execute a statement under a short lock timeout, retrying with exponential backoff
+
+    Each attempt runs in a subtransaction, so a timed out attempt holds no locks
+    while waiting to retry. Locks acquired by a successful attempt are held until
+    the surrounding transaction commits.
+
+    Args:
+        operations: The Alembic operations object
+        operation: The operation to execute
+    """
+
+    attempts = operation.attempts
+    operations.execute(f"""
+        DO $lock_retry$
+        DECLARE
+            previous_timeout text := current_setting('lock_timeout');
+        BEGIN
+            PERFORM set_config('lock_timeout', '{operation.lock_timeout}', true);
+            FOR attempt IN 1..{attempts} LOOP
+                BEGIN
+                    {operation.sql.strip().rstrip(';')};
+                    EXIT;
+                EXCEPTION WHEN lock_not_available THEN
+                    IF attempt = {attempts} THEN
+                        RAISE;
+                    END IF;
+
+                    RAISE NOTICE 'Could not acquire locks (attempt % of {attempts}), retrying', attempt;
+                    PERFORM pg_sleep(least(2 ^ attempt, 60));
+                END;
+            END LOOP;
+
+            PERFORM set_config('lock_timeout', previous_timeout, true);
+        END $lock_retry$;
+    """)
+
+
+@Operations.implementation_for(BackfillColumnOp)
+def backfill_column(operations: Operations, operation: BackfillColumnOp) -> None:
+    """Backfill a column in throttled batches and report progress as batches complete
+
+    The batch size and delay between batches are read from the
+    ``batch_size`` and ``batch_delay`` configuration options.
+
+    Args:
+        operations: The Alembic operations object
+        operation: The operation to execute
+
+    Raises:
+        ValueError: If the batch size is less than one or the batch delay is negative
+    """
+
+    table, column, key = operation.table_name, operation.column_name, operation.key
+    update_sql = f'UPDATE {table} SET {column} = {operation.expression}'
+    batch_size = int(config.get_main_option('batch_size', DEFAULT_BATCH_SIZE))
+    batch_delay = float(config.get_main_option('batch_delay', DEFAULT_BATCH_DELAY))
+    if batch_size < 1:
+        raise ValueError(f'Batch size must be at least 1, got {batch_size}')
+
+    if batch_delay < 0:
+        raise ValueError(f'Batch delay cannot be negative, got {batch_delay}')
+
+    # Batch boundaries cannot be determined without a live connection, so offline
+    # mode emits a server side loop that commits after each batch instead
+    if context.is_offline_mode():
+        with operations.get_context().autocommit_block():
+            operations.execute(f"""
+                DO $$
+                DECLARE
+                    lower_key bigint;
+                    max_key bigint;
+                BEGIN
+                    SELECT min({key}), max({key}) INTO lower_key, max_key FROM {table};
+                    WHILE lower_key <= max_key LOOP
+                        {update_sql}
+                        WHERE {key} >= lower_key AND {key} < lower_key + {batch_size}
+                        AND {column} IS DISTINCT FROM {operation.expression};
+
+                        COMMIT;
+                        RAISE NOTICE 'Backfilled {table}.{column} through key % of %', lower_key + {batch_size} - 1, max_key;
+                        PERFORM pg_sleep({batch_delay});
+                        lower_key := lower_key + {batch_size};
+                    END LOOP;
+                END $$
+            """)
+
+        return
+
+    with operations.get_context().autocommit_block():
+        connection = operations.get_bind()
+        min_key, max_key = connection.execute(sa.text(f'SELECT min({key}), max({key}) FROM {table}')).one()
+        if min_key is None:
+            return
+
+        logging.info(f'Backfilling {table}.{column} for keys {min_key} through {max_key}')
+        start = time.time()
+        total_keys = max_key - min_key + 1
+        for lower in range(min_key, max_key + 1, batch_size):
+            upper = lower + batch_size
+            connection.execute(
+                sa.text(
+                    f'{update_sql} WHERE {key} >= :lower AND {key} < :upper'
+                    f' AND {column} IS DISTINCT FROM {operation.expression}'
+                ),
+                {'lower': lower, 'upper': upper}
+            )
+
+            progress = min(upper - min_key, total_keys) / total_keys
+            logging.info(f'Backfilled {table}.{column}: {progress:.1%} complete ({time.time() - start:.0f} seconds)')
+            time.sleep(batch_delay)
+
 
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
@@ -30,6 +340,7 @@ def run_migrations_offline() -> None:
         target_metadata=None,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
     )
 
     with context.begin_transaction():
@@ -43,7 +354,7 @@ def do_run_migrations(connection: Connection) -> None:
         connection: An open database connection
     """
 
-    context.configure(connection=connection, target_metadata=None)
+    context.configure(connection=connection, target_metadata=None, transaction_per_migration=True)
     with context.begin_transaction():
         context.run_migrations()
 
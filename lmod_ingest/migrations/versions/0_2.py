@@ -3,6 +3,8 @@
 import sqlalchemy as sa
 from alembic import op
 
+from lmod_ingest.views import PACKAGE_COUNT_0_2, PACKAGE_VERSION_COUNT_0_2, UNIQUE_LOADS_0_2
+
 # Revision identifiers used by Alembic
 revision = '0.2'
 down_revision = '0.1'
@@ -16,50 +18,11 @@ def upgrade() -> None:
     op.add_column('log_data', sa.Column('jobid', sa.Integer(), nullable=True))
 
     # Introduce a new view with unique package loads modulo job ID
-    op.execute("""
-        CREATE VIEW unique_loads AS
-            SELECT DISTINCT
-                package,
-                version,
-                jobid,
-                max(time) as time
-            FROM log_data
-            WHERE jobid IS NOT NULL
-            GROUP BY
-                jobid,
-                version,
-                package;
-       """)
+    op.execute(f"CREATE VIEW unique_loads AS {UNIQUE_LOADS_0_2};")
 
     # Update existing views to include job ID information
-    op.execute("""
-        CREATE OR REPLACE VIEW package_count AS
-            SELECT
-                package,
-                COUNT(*) AS total,
-                max(time) AS lastload
-            FROM
-                unique_loads
-            GROUP BY
-                package
-            ORDER BY
-                package;
-       """)
-
-    op.execute("""
-        CREATE OR REPLACE VIEW package_version_count AS
-            SELECT
-                package,
-                version,
-                COUNT(*) AS total,
-                max(time) AS lastload
-            FROM
-                unique_loads
-            GROUP BY
-                package,
-                version
-            ORDER BY package, version;
-    """)
+    op.execute(f"CREATE OR REPLACE VIEW package_count AS {PACKAGE_COUNT_0_2};")
+    op.execute(f"CREATE OR REPLACE VIEW package_version_count AS {PACKAGE_VERSION_COUNT_0_2};")
 
 
 def downgrade() -> None:
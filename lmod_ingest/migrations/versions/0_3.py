@@ -0,0 +1,80 @@
+"""Alembic migration script for database schema version 0.3.
+
+Widens the ``jobid`` column to a ``BIGINT`` without locking the ``log_data``
+table for the duration of the migration. A shadow column is added, kept in
+sync with new records by a trigger, and backfilled in throttled batches.
+The shadow column is then swapped in place of the original in a single
+short-lived transaction.
+
+Steps preceding the swap are committed before the backfill begins and are
+idempotent, so the migration can be safely re-run if the swap fails.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from lmod_ingest.views import PACKAGE_COUNT_0_2, PACKAGE_VERSION_COUNT_0_2, UNIQUE_LOADS_0_2
+
+# Revision identifiers used by Alembic
+revision = '0.3'
+down_revision = '0.2'
+depends_on = None
+
+
+def drop_views() -> None:
+    """Drop all views that depend on the ``jobid`` column"""
+
+    op.execute("DROP VIEW IF EXISTS package_version_count;")
+    op.execute("DROP VIEW IF EXISTS package_count;")
+    op.execute("DROP VIEW IF EXISTS unique_loads;")
+
+
+def create_views() -> None:
+    """Recreate all views that depend on the ``jobid`` column"""
+
+    op.execute(f"CREATE VIEW unique_loads AS {UNIQUE_LOADS_0_2};")
+    op.execute(f"CREATE VIEW package_count AS {PACKAGE_COUNT_0_2};")
+    op.execute(f"CREATE VIEW package_version_count AS {PACKAGE_VERSION_COUNT_0_2};")
+
+
+def upgrade() -> None:
+    """Upgrade the database schema"""
+
+    # Add a nullable shadow column (a metadata only change) and keep it in sync with incoming records.
+    # Statements requiring table locks are retried instead of queueing behind long-running queries.
+    op.execute_with_lock_retry("ALTER TABLE log_data ADD COLUMN IF NOT EXISTS jobid_bigint BIGINT;")
+    op.execute("""
+        CREATE OR REPLACE FUNCTION log_data_sync_jobid() RETURNS trigger AS $$
+            BEGIN
+                NEW.jobid_bigint := NEW.jobid;
+                RETURN NEW;
+            END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute_with_lock_retry("""
+        CREATE OR REPLACE TRIGGER log_data_sync_jobid
+            BEFORE INSERT OR UPDATE OF jobid ON log_data
+            FOR EACH ROW EXECUTE FUNCTION log_data_sync_jobid();
+    """)
+
+    # Copy existing values into the shadow column while ingestion continues
+    op.backfill_column('log_data', 'jobid_bigint', 'jobid')
+
+    # Swap columns in a single transaction once the table lock is acquired
+    op.execute_with_lock_retry("LOCK TABLE log_data IN ACCESS EXCLUSIVE MODE;")
+
+    drop_views()
+    op.execute("DROP TRIGGER log_data_sync_jobid ON log_data;")
+    op.execute("DROP FUNCTION log_data_sync_jobid();")
+    op.drop_column('log_data', 'jobid')
+    op.alter_column('log_data', 'jobid_bigint', new_column_name='jobid')
+    create_views()
+
+
+def downgrade() -> None:
+    """Revert changes made to the database schema while upgrading"""
+
+    drop_views()
+    op.alter_column('log_data', 'jobid', type_=sa.Integer(), existing_type=sa.BigInteger())
+    create_views()
@@ -0,0 +1,36 @@
+"""Alembic migration script for database schema version 0.4.
+
+Adds the ``load_sketches`` table used to estimate distinct user and job
+counts. Sketches are maintained for newly ingested records, while sketches
+for existing records are built by the ``lmod-ingest rebuild-sketches`` command.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# Revision identifiers used by Alembic
+revision = '0.4'
+down_revision = '0.3'
+depends_on = None
+
+
+def upgrade() -> None:
+    """Upgrade the database schema"""
+
+    # Store approximate distinct user and job counts per package, version, and day
+    op.create_table(
+        'load_sketches',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('package', sa.String(100), nullable=False),
+        sa.Column('version', sa.String(150), nullable=True),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('users', sa.LargeBinary(), nullable=False),
+        sa.Column('jobs', sa.LargeBinary(), nullable=False),
+        sa.UniqueConstraint('package', 'version', 'day', name='unq_load_sketch', postgresql_nulls_not_distinct=True)
+    )
+
+
+def downgrade() -> None:
+    """Revert changes made to the database schema while upgrading"""
+
+    op.drop_table('load_sketches')
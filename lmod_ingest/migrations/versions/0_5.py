@@ -0,0 +1,56 @@
+"""Alembic migration script for database schema version 0.5.
+
+Adds indexes tuned for time-range queries and the job based views:
+
+- A BRIN index on ``time``. Records are ingested in roughly chronological
+  order, so a block range index supports time-range filtering at a tiny
+  fraction of the size and maintenance cost of a B-tree. Short time ranges
+  are still served by the ``unq_log_entry`` B-tree, but queries spanning a
+  large share of the table use the BRIN index where the planner would
+  otherwise fall back to a sequential scan (see ``benchmarks/view_queries.py``).
+- A partial covering index on ``(package, version, jobid)`` over records with
+  a job ID. The ``unique_loads`` view is rewritten to group columns in index
+  order (dropping a redundant ``DISTINCT``) so it can be computed by a
+  sort-free index only scan.
+
+The ``unq_log_entry`` key is left unchanged. Its leading ``time`` column
+already directs inserts of new (chronological) records to the right-most
+leaf pages of the index, which is the most insert friendly key order.
+
+All indexes are built concurrently so ingestion can continue during the upgrade.
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+from lmod_ingest.views import UNIQUE_LOADS_0_2, UNIQUE_LOADS_0_5
+
+# Revision identifiers used by Alembic
+revision = '0.5'
+down_revision = '0.4'
+depends_on = None
+
+
+def upgrade() -> None:
+    """Upgrade the database schema"""
+
+    op.create_index_concurrently('ix_log_data_time', 'log_data', ['time'], postgresql_using='brin')
+    op.create_index_concurrently(
+        'ix_log_data_job_loads',
+        'log_data',
+        ['package', 'version', 'jobid'],
+        postgresql_include=['time'],
+        postgresql_where=sa.text('jobid IS NOT NULL')
+    )
+
+    # Group on columns in the same order as the covering index
+    op.execute(f"CREATE OR REPLACE VIEW unique_loads AS {UNIQUE_LOADS_0_5};")
+
+
+def downgrade() -> None:
+    """Revert changes made to the database schema while upgrading"""
+
+    op.execute(f"CREATE OR REPLACE VIEW unique_loads AS {UNIQUE_LOADS_0_2};")
+
+    op.drop_index_concurrently('ix_log_data_job_loads', 'log_data')
+    op.drop_index_concurrently('ix_log_data_time', 'log_data')
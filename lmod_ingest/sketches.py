@@ -0,0 +1,390 @@
+"""Approximate distinct counting of users and jobs using HyperLogLog sketches.
+
+Sketches are maintained per package, version, and day and can be merged over
+arbitrary date ranges to estimate distinct counts without scanning the raw
+log data. Estimates have a standard error of roughly ``1.04 / sqrt(2 ** PRECISION)``.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+import zlib
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+# Number of hash bits used to select a register (2 ** PRECISION registers per sketch)
+PRECISION = 14
+
+
+class HyperLogLog:
+    """A mergeable HyperLogLog sketch for estimating the number of distinct values"""
+
+    def __init__(self, registers: np.ndarray | None = None) -> None:
+        """Create a new sketch
+
+        Args:
+            registers: Optional register values to initialize the sketch with
+        """
+
+        self.registers = np.zeros(2 ** PRECISION, dtype=np.uint8) if registers is None else registers
+
+    @staticmethod
+    def hash_value(value) -> int:
+        """Hash a single value to an unsigned 64-bit integer
+
+        Values are hashed by their text representation using a fixed hash
+        function, so stored sketches remain compatible across library versions.
+        Integral numbers are formatted as integers, so a job ID hashes to the
+        same value regardless of whether it is stored as an integer or a float.
+
+        Args:
+            value: The value to hash
+
+        Returns:
+            The hash value
+        """
+
+        if isinstance(value, (float, np.floating)) and float(value).is_integer():
+            value = int(value)
+
+        text = str(int(value)) if isinstance(value, (int, np.integer)) else str(value)
+        return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+    @classmethod
+    def hash_values(cls, values: pd.Series) -> np.ndarray:
+        """Hash a series of non-null values to unsigned 64-bit integers
+
+        Each distinct value is only hashed once.
+
+        Args:
+            values: The values to hash
+
+        Returns:
+            An array with the hash of each value
+        """
+
+        codes, unique = pd.factorize(values)
+        hashes = np.fromiter((cls.hash_value(value) for value in unique), dtype=np.uint64, count=len(unique))
+        return hashes[codes]
+
+    def update(self, values: pd.Series) -> None:
+        """Add values to the sketch
+
+        Null values are ignored.
+
+        Args:
+            values: The values to add
+        """
+
+        self.update_hashes(self.hash_values(values.dropna()))
+
+    def update_hashes(self, hashes: np.ndarray) -> None:
+        """Add pre-computed value hashes to the sketch
+
+        Args:
+            hashes: Hash values returned by ``hash_values``
+        """
+
+        if not len(hashes):
+            return
+
+        # The leading bits select a register and the remaining bits determine the rank
+        index = (hashes >> np.uint64(64 - PRECISION)).astype(np.intp)
+        remainder = hashes & np.uint64((1 << (64 - PRECISION)) - 1)
+
+        # The remainder fits in a float64 without rounding, so ``frexp`` yields its exact bit length
+        _, bit_length = np.frexp(remainder.astype(np.float64))
+        rank = (64 - PRECISION - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        """Merge another sketch into this one
+
+        Args:
+            other: The sketch to merge
+        """
+
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        """Estimate the number of distinct values added to the sketch
+
+        Returns:
+            The estimated cardinality
+        """
+
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw_estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+
+        # Fall back on linear counting for small cardinalities
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw_estimate <= 2.5 * m and zeros:
+            return round(m * np.log(m / zeros))
+
+        return round(raw_estimate)
+
+    def to_bytes(self) -> bytes:
+        """Serialize the sketch for storage in the database
+
+        Returns:
+            The compressed sketch registers
+        """
+
+        return zlib.compress(self.registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        """Deserialize a sketch from the database
+
+        Args:
+            data: Compressed sketch registers
+
+        Returns:
+            A new sketch instance
+        """
+
+        return cls(np.frombuffer(zlib.decompress(data), dtype=np.uint8).copy())
+
+
+def sketch_lock_key(package: str, version: str | None, day: date) -> int:
+    """Return the advisory lock key used to serialize updates to a single sketch
+
+    Args:
+        package: The package name
+        version: The package version
+        day: The day summarized by the sketch
+
+    Returns:
+        A signed 64-bit integer lock key
+    """
+
+    key = f'{package}\0{version}\0{day.isoformat()}'.encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big', signed=True)
+
+
+def build_sketches(data: pd.DataFrame) -> list[dict]:
+    """Build distinct user and job sketches for each package, version, and day
+
+    Args:
+        data: Log data following the same data model as the ``log_data`` table
+
+    Returns:
+        A list of records with the keys ``package``, ``version``, ``day``, ``users``, and ``jobs``
+    """
+
+    if data.empty:
+        return []
+
+    packages = data['package'].to_numpy()
+    versions = data['version'].to_numpy()
+    days = pd.to_datetime(data['time']).dt.date.to_numpy()
+    group_ids = pd.DataFrame({'package': packages, 'version': versions, 'day': days}).groupby(
+        ['package', 'version', 'day'], dropna=False, sort=False).ngroup().to_numpy()
+
+    # Order records by group so each group is a contiguous slice of the precomputed hashes
+    order = np.argsort(group_ids, kind='stable')
+    bounds = np.searchsorted(group_ids[order], np.arange(group_ids.max() + 2))
+
+    # Hash each column once for all groups instead of separately for every group
+    hashes, is_valid = {}, {}
+    for column in ('user', 'jobid'):
+        values = data[column]
+        valid = values.notna().to_numpy()
+        column_hashes = np.zeros(len(values), dtype=np.uint64)
+        column_hashes[valid] = HyperLogLog.hash_values(values[valid])
+        hashes[column], is_valid[column] = column_hashes[order], valid[order]
+
+    records = []
+    for lower, upper in zip(bounds[:-1], bounds[1:]):
+        users, jobs = HyperLogLog(), HyperLogLog()
+        users.update_hashes(hashes['user'][lower:upper][is_valid['user'][lower:upper]])
+        jobs.update_hashes(hashes['jobid'][lower:upper][is_valid['jobid'][lower:upper]])
+
+        first = order[lower]
+        records.append({
+            'package': packages[first],
+            'version': None if pd.isna(versions[first]) else versions[first],
+            'day': days[first],
+            'users': users,
+            'jobs': jobs
+        })
+
+    return records
+
+
+async def ingest_sketches_to_db(data: pd.DataFrame, connection, name: str = 'load_sketches') -> None:
+    """Merge log data into the sketches stored in a database
+
+    Existing sketches are merged with the new data before being written back,
+    so ingesting the same records multiple times has no effect. Updates to each
+    sketch are serialized using transaction level advisory locks, which (unlike
+    row locks) also cover sketches that do not exist yet.
+
+    Args:
+        data: Log data following the same data model as the ``log_data`` table
+        connection: An open database connection
+        name: Name of the database table storing sketches
+    """
+
+    if data.empty:
+        return
+
+    metadata = sa.MetaData()
+    await connection.run_sync(metadata.reflect, only=[name])
+    table = sa.Table(name, metadata, autoload_with=connection)
+
+    sketches = build_sketches(data)
+
+    # Lock every sketch being updated until the transaction commits
+    # Keys are locked in sorted order so concurrent ingestions cannot deadlock
+    lock_keys = sorted({sketch_lock_key(s['package'], s['version'], s['day']) for s in sketches})
+    await connection.execute(
+        sa.text(
+            'SELECT pg_advisory_xact_lock(key) FROM (SELECT unnest(:keys) AS key ORDER BY key) AS lock_keys'
+        ).bindparams(sa.bindparam('keys', type_=ARRAY(sa.BigInteger))),
+        {'keys': lock_keys}
+    )
+
+    # Merge any sketches that already exist for the ingested packages and days
+    existing = await connection.execute(
+        sa.select(table)
+        .where(table.c.package.in_({sketch['package'] for sketch in sketches}))
+        .where(table.c.day.between(min(sketch['day'] for sketch in sketches), max(sketch['day'] for sketch in sketches)))
+    )
+
+    stored = {(row.package, row.version, row.day): row for row in existing}
+    records = []
+    for sketch in sketches:
+        if (match := stored.get((sketch['package'], sketch['version'], sketch['day']))) is not None:
+            sketch['users'].merge(HyperLogLog.from_bytes(match.users))
+            sketch['jobs'].merge(HyperLogLog.from_bytes(match.jobs))
+
+        records.append({**sketch, 'users': sketch['users'].to_bytes(), 'jobs': sketch['jobs'].to_bytes()})
+
+    # Ingest data as chunks to avoid Postgres limits on the number of variables
+    chunk_size = 32000 // len(table.columns)
+    for i in range(0, len(records), chunk_size):
+        insert_stmt = insert(table).values(records[i:i + chunk_size])
+        upsert_stmt = insert_stmt.on_conflict_do_update(
+            constraint='unq_load_sketch',
+            set_={'users': insert_stmt.excluded.users, 'jobs': insert_stmt.excluded.jobs}
+        )
+        await connection.execute(upsert_stmt)
+
+    await connection.commit()
+
+
+async def rebuild_sketches_from_db(
+    connection,
+    batch_size: int,
+    batch_delay: float,
+    log_table: str = 'log_data',
+    sketch_table: str = 'load_sketches'
+) -> None:
+    """Build sketches from the log data already stored in a database
+
+    Records are read in throttled batches over ranges of the ``id`` column and
+    merged into the stored sketches, with each batch committed independently.
+    Merging is idempotent, so the rebuild can run alongside ongoing ingestion
+    and can be safely repeated or resumed after an interruption.
+
+    Args:
+        connection: An open database connection
+        batch_size: Number of records to read per batch
+        batch_delay: Seconds to wait between batches
+        log_table: Name of the database table storing raw log data
+        sketch_table: Name of the database table storing sketches
+    """
+
+    metadata = sa.MetaData()
+    await connection.run_sync(metadata.reflect, only=[log_table])
+    table = sa.Table(log_table, metadata, autoload_with=connection)
+
+    min_key, max_key = (await connection.execute(sa.select(sa.func.min(table.c.id), sa.func.max(table.c.id)))).one()
+    await connection.commit()
+    if min_key is None:
+        return
+
+    logging.info(f'Building sketches from {log_table} records {min_key} through {max_key}')
+    start = time.time()
+    total_keys = max_key - min_key + 1
+    columns = [table.c.time, table.c.user, table.c.package, table.c.version, table.c.jobid]
+    for lower in range(min_key, max_key + 1, batch_size):
+        upper = lower + batch_size
+        result = await connection.execute(sa.select(*columns).where(table.c.id >= lower, table.c.id < upper))
+        data = pd.DataFrame(result.all(), columns=list(result.keys()))
+        await ingest_sketches_to_db(data, connection, sketch_table)
+        await connection.commit()
+
+        progress = min(upper - min_key, total_keys) / total_keys
+        logging.info(f'Built sketches: {progress:.1%} complete ({time.time() - start:.0f} seconds)')
+        await asyncio.sleep(batch_delay)
+
+
+async def count_distinct(
+    connection,
+    package: str,
+    version: str | None = None,
+    start: date | None = None,
+    end: date | None = None,
+    exact: bool = False,
+    log_table: str = 'log_data',
+    sketch_table: str = 'load_sketches'
+) -> dict[str, int]:
+    """Count the distinct users and Slurm jobs that loaded a package
+
+    Counts are estimated by merging the stored daily sketches unless ``exact``
+    is enabled, in which case they are calculated from the raw log data.
+
+    Args:
+        connection: An open database connection
+        package: The package name
+        version: Optionally limit counts to a single package version
+        start: Optionally limit counts to records on or after the given date
+        end: Optionally limit counts to records before the given date
+        exact: Calculate exact counts instead of estimates
+        log_table: Name of the database table storing raw log data
+        sketch_table: Name of the database table storing sketches
+
+    Returns:
+        A dictionary with the distinct ``users`` and ``jobs`` counts
+    """
+
+    table_name = log_table if exact else sketch_table
+    time_column = 'time' if exact else 'day'
+    metadata = sa.MetaData()
+    await connection.run_sync(metadata.reflect, only=[table_name])
+    table = sa.Table(table_name, metadata, autoload_with=connection)
+
+    conditions = [table.c.package == package]
+    if version is not None:
+        conditions.append(table.c.version == version)
+
+    if start is not None:
+        conditions.append(table.c[time_column] >= start)
+
+    if end is not None:
+        conditions.append(table.c[time_column] < end)
+
+    if exact:
+        query = sa.select(
+            sa.func.count(sa.distinct(table.c.user)),
+            sa.func.count(sa.distinct(table.c.jobid))
+        ).where(*conditions)
+
+        users, jobs = (await connection.execute(query)).one()
+        return {'users': users, 'jobs': jobs}
+
+    users, jobs = HyperLogLog(), HyperLogLog()
+    result = await connection.execute(sa.select(table.c.users, table.c.jobs).where(*conditions))
+    for row in result:
+        users.merge(HyperLogLog.from_bytes(row.users))
+        jobs.merge(HyperLogLog.from_bytes(row.jobs))
+
+    return {'users': users.estimate(), 'jobs': jobs.estimate()}
@@ -3,6 +3,7 @@
 import logging
 import os
 import time
+from datetime import date
 from pathlib import Path
 
 import pandas as pd
@@ -10,6 +11,8 @@ import sqlalchemy as sa
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import create_async_engine
 
+from .sketches import count_distinct, ingest_sketches_to_db, rebuild_sketches_from_db
+
 # Default database connection values
 DEFAULT_HOST = 'localhost'
 DEFAULT_PORT = 5432
@@ -129,3 +132,49 @@ async def ingest_file(path: Path, url: str) -> None:
         start = time.time()
         await ingest_data_to_db(data, 'log_data', connection=connection)
         logging.info(f'Ingested {len(data)} log entries in {time.time() - start:.2f} seconds')
+
+        logging.info(f'Updating distinct count sketches')
+        start = time.time()
+        await ingest_sketches_to_db(data, connection=connection)
+        logging.info(f'Updated sketches in {time.time() - start:.2f} seconds')
+
+
+async def count_package(
+    url: str,
+    package: str,
+    version: str | None = None,
+    start: date | None = None,
+    end: date | None = None,
+    exact: bool = False
+) -> dict[str, int]:
+    """Count the distinct users and Slurm jobs that loaded a package
+
+    Args:
+        url: The database URL
+        package: The package name
+        version: Optionally limit counts to a single package version
+        start: Optionally limit counts to records on or after the given date
+        end: Optionally limit counts to records before the given date
+        exact: Calculate exact counts from the raw log data instead of estimates
+
+    Returns:
+        A dictionary with the distinct ``users`` and ``jobs`` counts
+    """
+
+    db_engine = create_async_engine(url=url)
+    async with db_engine.connect() as connection:
+        return await count_distinct(connection, package, version, start, end, exact)
+
+
+async def rebuild_sketches(url: str, batch_size: int, batch_delay: float) -> None:
+    """Build distinct count sketches from the log data already stored in a database
+
+    Args:
+        url: The database URL
+        batch_size: Number of records to read per batch
+        batch_delay: Seconds to wait between batches
+    """
+
+    db_engine = create_async_engine(url=url)
+    async with db_engine.connect() as connection:
+        await rebuild_sketches_from_db(connection, batch_size, batch_delay)
@@ -0,0 +1,67 @@
+"""SQL queries defining the predefined database views.
+
+View definitions are shared by the Alembic migrations and the DuckDB schema
+so both backends provide identical views. Each definition is named after the
+schema version that introduced it. Migrations for older schema versions
+depend on these definitions, so a released definition is never edited.
+Changes to a view are instead added as a new definition and applied by a new
+migration (and a matching DuckDB migration step).
+"""
+
+# Views introduced in schema version 0.2
+UNIQUE_LOADS_0_2 = """
+    SELECT DISTINCT
+        package,
+        version,
+        jobid,
+        max(time) as time
+    FROM log_data
+    WHERE jobid IS NOT NULL
+    GROUP BY
+        jobid,
+        version,
+        package
+"""
+
+PACKAGE_COUNT_0_2 = """
+    SELECT
+        package,
+        COUNT(*) AS total,
+        max(time) AS lastload
+    FROM
+        unique_loads
+    GROUP BY
+        package
+    ORDER BY
+        package
+"""
+
+PACKAGE_VERSION_COUNT_0_2 = """
+    SELECT
+        package,
+        version,
+        COUNT(*) AS total,
+        max(time) AS lastload
+    FROM
+        unique_loads
+    GROUP BY
+        package,
+        version
+    ORDER BY package, version
+"""
+
+# Views updated in schema version 0.5
+# Columns are grouped in the same order as the ``ix_log_data_job_loads`` covering index
+UNIQUE_LOADS_0_5 = """
+    SELECT
+        package,
+        version,
+        jobid,
+        max(time) as time
+    FROM log_data
+    WHERE jobid IS NOT NULL
+    GROUP BY
+        package,
+        version,
+        jobid
+"""
@@ -0,0 +1,196 @@
+"""Tests for the ``backends`` module"""
+
+import importlib.util
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, skipUnless
+
+import pandas as pd
+
+from lmod_ingest.backends import CURRENT_SCHEMA_VERSION, DUCKDB_VERSION_TABLE, DuckDBBackend, PostgresBackend, fetch_backend
+from lmod_ingest.utils import parse_log_data
+from . import mock
+
+DUCKDB_INSTALLED = importlib.util.find_spec('duckdb') is not None
+
+
+class TestFetchBackend(TestCase):
+    """Tests for the ``fetch_backend`` function"""
+
+    def setUp(self) -> None:
+        """Clear the working environment"""
+
+        self.old_env = os.environ.copy()
+        os.environ.clear()
+
+    def tearDown(self) -> None:
+        """Restore the working environment"""
+
+        os.environ.clear()
+        os.environ.update(self.old_env)
+
+    def test_postgres_default(self) -> None:
+        """Test the Postgres backend is returned when no backend is specified"""
+
+        os.environ.update(DB_USER='user', DB_PASS='pass', DB_NAME='name')
+        self.assertIsInstance(fetch_backend(), PostgresBackend)
+
+    @skipUnless(DUCKDB_INSTALLED, 'DuckDB is not installed')
+    def test_duckdb_backend(self) -> None:
+        """Test the DuckDB backend is returned when configured"""
+
+        with TemporaryDirectory() as temp_dir:
+            os.environ.update(DB_BACKEND='duckdb', DB_PATH=str(Path(temp_dir) / 'test.db'))
+            self.assertIsInstance(fetch_backend(), DuckDBBackend)
+
+    def test_duckdb_missing_path(self) -> None:
+        """Test an error is raised when the DuckDB path is not specified"""
+
+        os.environ.update(DB_BACKEND='duckdb')
+        with self.assertRaises(ValueError):
+            fetch_backend()
+
+    def test_unknown_backend(self) -> None:
+        """Test an error is raised for unknown backend names"""
+
+        os.environ.update(DB_BACKEND='fake_backend')
+        with self.assertRaises(ValueError):
+            fetch_backend()
+
+
+@skipUnless(DUCKDB_INSTALLED, 'DuckDB is not installed')
+class TestDuckDBBackend(TestCase):
+    """Tests for the ``DuckDBBackend`` class"""
+
+    def setUp(self) -> None:
+        """Create an in-memory database with the application schema"""
+
+        self.backend = DuckDBBackend(':memory:')
+        self.backend.migrate()
+
+    def test_migration_is_repeatable(self) -> None:
+        """Test applying the schema to an up-to-date database has no effect"""
+
+        self.backend.ingest_file(mock.TEST_PATH)
+        self.backend.migrate()
+        self.assertEqual(2, self.backend.connection.execute('SELECT COUNT(*) FROM log_data').fetchone()[0])
+
+    def test_version_recorded(self) -> None:
+        """Test the current schema version is recorded after migrating"""
+
+        self.assertEqual(CURRENT_SCHEMA_VERSION, self.backend.schema_version())
+        self.assertEqual(1, self.backend.connection.execute(f'SELECT COUNT(*) FROM {DUCKDB_VERSION_TABLE}').fetchone()[0])
+
+    def test_unmigrated_database(self) -> None:
+        """Test operations on a database without a schema raise an error"""
+
+        backend = DuckDBBackend(':memory:')
+        self.assertIsNone(backend.schema_version())
+        with self.assertRaises(RuntimeError):
+            backend.ingest_file(mock.TEST_PATH)
+
+        with self.assertRaises(RuntimeError):
+            backend.count('gcc')
+
+    def test_version_mismatch(self) -> None:
+        """Test operations raise an error when the schema version does not match"""
+
+        self.backend.connection.execute(f"UPDATE {DUCKDB_VERSION_TABLE} SET version = '0.4'")
+        with self.assertRaises(RuntimeError):
+            self.backend.ingest_file(mock.TEST_PATH)
+
+        with self.assertRaises(RuntimeError):
+            self.backend.count('gcc')
+
+    def test_unknown_version(self) -> None:
+        """Test migrating a database with an unrecognized schema version raises an error"""
+
+        self.backend.connection.execute(f"UPDATE {DUCKDB_VERSION_TABLE} SET version = '99.0'")
+        with self.assertRaises(RuntimeError):
+            self.backend.migrate()
+
+    def test_unversioned_database(self) -> None:
+        """Test migrating a database with existing tables but no schema version raises an error"""
+
+        backend = DuckDBBackend(':memory:')
+        backend.connection.execute('CREATE TABLE log_data (id BIGINT)')
+        with self.assertRaises(RuntimeError):
+            backend.migrate()
+
+    def test_data_ingested(self) -> None:
+        """Test log data is ingested into the database table"""
+
+        self.backend.ingest_file(mock.TEST_PATH)
+        result = self.backend.connection.execute('SELECT "user", jobid, version FROM log_data ORDER BY "user"').fetchall()
+        self.assertEqual([('user1', 1, '8.2.0'), ('user2', None, None)], result)
+
+    def test_duplicates_ignored(self) -> None:
+        """Test ingesting the same file multiple times does not create duplicate entries"""
+
+        self.backend.ingest_file(mock.TEST_PATH)
+        self.backend.ingest_file(mock.TEST_PATH)
+        self.assertEqual(2, self.backend.connection.execute('SELECT COUNT(*) FROM log_data').fetchone()[0])
+        self.assertEqual(2, self.backend.connection.execute('SELECT COUNT(*) FROM load_sketches').fetchone()[0])
+
+    def test_sketches_merged(self) -> None:
+        """Test sketches for the same package, version, and day are merged into a single record"""
+
+        data = parse_log_data(mock.TEST_PATH)
+        self.backend.ingest_sketches(data.iloc[[1]])
+        self.backend.ingest_sketches(data.iloc[[1]].assign(user='user3'))
+
+        result = self.backend.connection.execute('SELECT package, version FROM load_sketches').fetchall()
+        self.assertEqual([('openmpi', None)], result)
+        self.assertEqual({'users': 2, 'jobs': 0}, self.backend.count('openmpi'))
+
+    def test_empty_data(self) -> None:
+        """Test empty data frames are handled without error"""
+
+        empty_data = parse_log_data(mock.TEST_PATH).iloc[0:0]
+        self.backend.ingest_data(empty_data)
+        self.backend.ingest_sketches(empty_data)
+        self.assertEqual(0, self.backend.connection.execute('SELECT COUNT(*) FROM log_data').fetchone()[0])
+
+    def test_views(self) -> None:
+        """Test database views are populated from ingested data"""
+
+        self.backend.ingest_file(mock.TEST_PATH)
+        result = self.backend.connection.execute('SELECT package, total FROM package_count').fetchall()
+        self.assertEqual([('gcc', 1)], result)
+
+    def test_count(self) -> None:
+        """Test estimated and exact distinct counts match for small data sets"""
+
+        self.backend.ingest_file(mock.TEST_PATH)
+        for exact in (True, False):
+            self.assertEqual({'users': 1, 'jobs': 1}, self.backend.count('gcc', exact=exact))
+            self.assertEqual({'users': 1, 'jobs': 1}, self.backend.count('gcc', version='8.2.0', exact=exact))
+            self.assertEqual({'users': 0, 'jobs': 0}, self.backend.count('gcc', version='1.0', exact=exact))
+            self.assertEqual({'users': 1, 'jobs': 0}, self.backend.count('openmpi', exact=exact))
+
+    def test_null_and_empty_versions(self) -> None:
+        """Test modules without a version are counted separately from modules with an empty version"""
+
+        # Loading ``gcc`` and ``gcc/`` produces a null and an empty version string respectively
+        data = parse_log_data(mock.TEST_PATH).iloc[[0, 0]]
+        data = data.assign(user=['user1', 'user2'], version=[None, ''])
+        self.backend.ingest_data(data.assign(time=data['time'] + pd.to_timedelta([0, 1], unit='s')))
+        self.backend.ingest_sketches(data)
+        self.backend.ingest_sketches(data)
+
+        result = self.backend.connection.execute('SELECT version FROM load_sketches ORDER BY version').fetchall()
+        self.assertEqual([('',), (None,)], result)
+        for exact in (True, False):
+            self.assertEqual({'users': 2, 'jobs': 1}, self.backend.count('gcc', exact=exact))
+            self.assertEqual({'users': 1, 'jobs': 1}, self.backend.count('gcc', version='', exact=exact))
+
+    def test_rebuild_sketches(self) -> None:
+        """Test sketches rebuilt from existing log data match exact counts"""
+
+        self.backend.ingest_data(parse_log_data(mock.TEST_PATH))
+        self.assertEqual({'users': 0, 'jobs': 0}, self.backend.count('gcc'))
+
+        self.backend.rebuild_sketches(batch_size=1, batch_delay=0)
+        for package in ('gcc', 'openmpi'):
+            self.assertEqual(self.backend.count(package, exact=True), self.backend.count(package))
@@ -1,9 +1,12 @@
 """Tests for the ``main`` module"""
 
+from contextlib import redirect_stderr
+from datetime import date
+from io import StringIO
 from pathlib import Path
 from unittest import TestCase
 
-from lmod_ingest.main import create_parser, ingest, migrate
+from lmod_ingest.main import count, create_parser, ingest, migrate, rebuild_sketches
 
 
 class CreateParser(TestCase):
@@ -21,6 +24,24 @@ class CreateParser(TestCase):
         self.assertIsInstance(args.path, Path)
         self.assertIs(args.callable, ingest)
 
+    def test_count_command_parsing(self) -> None:
+        """Test argument parsing by the ``count`` subparser"""
+
+        args = create_parser().parse_args(['count', 'gcc'])
+        self.assertEqual('gcc', args.package)
+        self.assertIsNone(args.version)
+        self.assertIsNone(args.start)
+        self.assertIsNone(args.end)
+        self.assertFalse(args.exact)
+        self.assertIs(args.callable, count)
+
+        args = create_parser().parse_args(
+            ['count', 'gcc', '--version', '8.2.0', '--start', '2023-01-01', '--end', '2024-01-01', '--exact'])
+        self.assertEqual('8.2.0', args.version)
+        self.assertEqual(date(2023, 1, 1), args.start)
+        self.assertEqual(date(2024, 1, 1), args.end)
+        self.assertTrue(args.exact)
+
     def test_migrate_command_parsing(self) -> None:
         """Test argument parsing by the ``migrate`` subparser"""
 
@@ -30,4 +51,32 @@ class CreateParser(TestCase):
         args = create_parser().parse_args(['migrate', '--sql'])
         self.assertTrue(args.sql)
 
+        args = create_parser().parse_args(['migrate', '--batch-size', '100', '--batch-delay', '0.5'])
+        self.assertEqual(100, args.batch_size)
+        self.assertEqual(0.5, args.batch_delay)
+
+        args = create_parser().parse_args(['migrate', '--batch-delay', '0'])
+        self.assertEqual(0, args.batch_delay)
+
         self.assertIs(args.callable, migrate)
+
+    def test_rebuild_sketches_command_parsing(self) -> None:
+        """Test argument parsing by the ``rebuild-sketches`` subparser"""
+
+        args = create_parser().parse_args(['rebuild-sketches', '--batch-size', '100', '--batch-delay', '0.5'])
+        self.assertEqual(100, args.batch_size)
+        self.assertEqual(0.5, args.batch_delay)
+        self.assertIs(args.callable, rebuild_sketches)
+
+    def test_invalid_batch_settings(self) -> None:
+        """Test batch sizes below one and negative batch delays are rejected"""
+
+        for args in (
+            ['migrate', '--batch-size', '0'],
+            ['migrate', '--batch-size', '-1'],
+            ['migrate', '--batch-size', 'abc'],
+            ['migrate', '--batch-delay', '-0.5'],
+            ['rebuild-sketches', '--batch-size', '0'],
+        ):
+            with self.subTest(args=args), self.assertRaises(SystemExit), redirect_stderr(StringIO()):
+                self.parser.parse_args(args)
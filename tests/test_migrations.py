@@ -0,0 +1,225 @@
+"""Tests for the Alembic database migrations"""
+
+import asyncio
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+
+import sqlalchemy as sa
+from alembic import command
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from lmod_ingest.backends import CURRENT_SCHEMA_VERSION, DUCKDB_VERSION_TABLE, DuckDBBackend, PostgresBackend
+from lmod_ingest.utils import fetch_db_url
+
+DUCKDB_INSTALLED = importlib.util.find_spec('duckdb') is not None
+
+# Largest value supported by the original ``INTEGER`` job ID column
+MAX_INTEGER = 2 ** 31 - 1
+
+INSERT_LOG_ENTRY = sa.text("""
+    INSERT INTO log_data (logname, time, host, "user", module, path, package, version, jobid)
+    VALUES ('test.log', now() + make_interval(secs => :jobid), 'host', :user, 'gcc/8.2.0', '/path', 'gcc', '8.2.0', :jobid)
+""")
+
+# Postgres data types and their DuckDB equivalents
+# DuckDB does not enforce ``VARCHAR`` lengths, so string lengths are not compared
+DUCKDB_TYPES = {
+    'bigint': 'BIGINT',
+    'bytea': 'BLOB',
+    'character varying': 'VARCHAR',
+    'date': 'DATE',
+    'integer': 'INTEGER',
+    'timestamp without time zone': 'TIMESTAMP',
+}
+
+# Records used to compare view definitions, written in SQL supported by both backends
+INSERT_VIEW_RECORDS = """
+    INSERT INTO log_data (logname, time, host, "user", module, path, package, version, jobid) VALUES
+        ('test.log', '2023-01-01 12:00:00', 'host1', 'user1', 'gcc/8.2.0', '/path', 'gcc', '8.2.0', 1),
+        ('test.log', '2023-01-01 13:00:00', 'host1', 'user1', 'gcc/8.2.0', '/path', 'gcc', '8.2.0', 1),
+        ('test.log', '2023-01-02 12:00:00', 'host2', 'user2', 'gcc/9.1.0', '/path', 'gcc', '9.1.0', 2),
+        ('test.log', '2023-01-02 12:00:00', 'host2', 'user2', 'openmpi', '/path', 'openmpi', NULL, 2),
+        ('test.log', '2023-01-03 12:00:00', 'host3', 'user3', 'openmpi', '/path', 'openmpi', NULL, 3),
+        ('test.log', '2023-01-03 12:00:00', 'host3', 'user3', 'python/3.11', '/path', 'python', '3.11', NULL)
+"""
+
+
+async def execute(url: str, *statements: sa.TextClause | str, **params) -> list[list[tuple]]:
+    """Execute SQL statements in autocommit mode and return their results
+
+    Args:
+        url: The database URL
+        *statements: The statements to execute
+        **params: Bound parameter values shared by all statements
+
+    Returns:
+        The rows returned by each statement
+    """
+
+    engine = create_async_engine(url, isolation_level='AUTOCOMMIT')
+    try:
+        async with engine.connect() as connection:
+            results = []
+            for statement in statements:
+                result = await connection.execute(sa.text(statement) if isinstance(statement, str) else statement, params)
+                results.append(result.all() if result.returns_rows else [])
+
+            return results
+
+    finally:
+        await engine.dispose()
+
+
+class TestPostgresMigrations(TestCase):
+    """Test migrations are applied to a scratch Postgres database"""
+
+    def setUp(self) -> None:
+        """Create an empty scratch database"""
+
+        self.admin_url = fetch_db_url()
+        url = sa.make_url(self.admin_url)
+        self.db_name = f'{url.database}_migrations'
+        self.url = url.set(database=self.db_name).render_as_string(hide_password=False)
+        self.backend = PostgresBackend(self.url)
+
+        asyncio.run(execute(
+            self.admin_url,
+            f'DROP DATABASE IF EXISTS {self.db_name} WITH (FORCE)',
+            f'CREATE DATABASE {self.db_name}'
+        ))
+
+    def tearDown(self) -> None:
+        """Drop the scratch database"""
+
+        asyncio.run(execute(self.admin_url, f'DROP DATABASE IF EXISTS {self.db_name} WITH (FORCE)'))
+
+    def insert_log_entry(self, user: str, jobid: int) -> None:
+        """Insert a single record into the ``log_data`` table
+
+        Args:
+            user: The user name of the record
+            jobid: The job ID of the record
+        """
+
+        asyncio.run(execute(self.url, INSERT_LOG_ENTRY, user=user, jobid=jobid))
+
+    def test_upgrade_to_head(self) -> None:
+        """Test upgrading from version 0.2 widens the ``jobid`` column without losing records"""
+
+        command.upgrade(self.backend.alembic_config(), '0.2')
+        for i in range(10):
+            self.insert_log_entry(f'user{i}', MAX_INTEGER - i)
+
+        # Insert records from a separate connection while the backfill pauses between batches
+        # Records inserted after the final batch are only copied by the trigger before the swap
+        inserted = []
+
+        def insert_during_backfill(delay: float) -> None:
+            jobid = len(inserted) + 1
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(asyncio.run, execute(self.url, INSERT_LOG_ENTRY, user='concurrent', jobid=jobid)).result()
+
+            inserted.append(jobid)
+
+        with patch('time.sleep', side_effect=insert_during_backfill):
+            self.backend.migrate(batch_size=3, batch_delay=0)
+
+        self.assertEqual(4, len(inserted))
+        self.insert_log_entry('bigint', 2 ** 40)
+
+        data_type, jobids, version = asyncio.run(execute(
+            self.url,
+            "SELECT data_type FROM information_schema.columns WHERE table_name = 'log_data' AND column_name = 'jobid'",
+            'SELECT jobid FROM log_data ORDER BY jobid',
+            'SELECT version_num FROM alembic_version'
+        ))
+
+        self.assertEqual([('bigint',)], data_type)
+        expected = sorted([*inserted, *(MAX_INTEGER - i for i in range(10)), 2 ** 40])
+        self.assertEqual(expected, [jobid for jobid, in jobids])
+        self.assertEqual([(CURRENT_SCHEMA_VERSION,)], version)
+
+    def test_invalid_index_rebuilt(self) -> None:
+        """Test upgrading replaces an invalid index left behind by a failed concurrent build"""
+
+        command.upgrade(self.backend.alembic_config(), '0.4')
+        self.insert_log_entry('user1', 1)
+        self.insert_log_entry('user2', 2)
+
+        # Duplicate package names cause a unique index build to fail after the index is created
+        with self.assertRaises(sa.exc.IntegrityError):
+            asyncio.run(execute(self.url, 'CREATE UNIQUE INDEX CONCURRENTLY ix_log_data_job_loads ON log_data (package)'))
+
+        index_query = """
+            SELECT i.indisvalid, i.indisunique FROM pg_index i
+            WHERE i.indexrelid = 'ix_log_data_job_loads'::regclass
+        """
+
+        self.assertEqual([(False, True)], asyncio.run(execute(self.url, index_query))[0])
+        self.backend.migrate()
+        self.assertEqual([(True, False)], asyncio.run(execute(self.url, index_query))[0])
+
+    @skipUnless(DUCKDB_INSTALLED, 'DuckDB is not installed')
+    def test_duckdb_schema_matches_head(self) -> None:
+        """Test the DuckDB schema defines the same tables, columns, keys, and views as the Alembic head"""
+
+        self.backend.migrate()
+        duckdb_backend = DuckDBBackend(':memory:')
+        duckdb_backend.migrate()
+
+        postgres_tables, postgres_columns, postgres_keys = asyncio.run(execute(
+            self.url,
+            "SELECT table_name, table_type FROM information_schema.tables "
+            "WHERE table_schema = 'public' AND table_name <> 'alembic_version'",
+            "SELECT table_name, column_name, is_nullable, data_type FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name <> 'alembic_version' ORDER BY table_name, ordinal_position",
+            """
+            SELECT c.conrelid::regclass::text, c.contype::text, array_agg(a.attname::text ORDER BY k.ord)
+            FROM pg_constraint c
+            CROSS JOIN unnest(c.conkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+            WHERE c.contype IN ('p', 'u') AND c.connamespace = 'public'::regnamespace
+                AND c.conrelid <> 'alembic_version'::regclass
+            GROUP BY c.conrelid, c.contype, c.conname
+            """
+        ))
+
+        duckdb = duckdb_backend.connection
+        duckdb_tables = duckdb.execute(
+            "SELECT table_name, table_type FROM information_schema.tables "
+            "WHERE table_schema = 'main' AND table_name <> ?", [DUCKDB_VERSION_TABLE]
+        ).fetchall()
+
+        duckdb_columns = duckdb.execute(
+            "SELECT table_name, column_name, is_nullable, data_type FROM information_schema.columns "
+            "WHERE table_schema = 'main' AND table_name <> ? ORDER BY table_name, ordinal_position",
+            [DUCKDB_VERSION_TABLE]
+        ).fetchall()
+
+        duckdb_keys = duckdb.execute(
+            "SELECT table_name, constraint_type, constraint_column_names FROM duckdb_constraints() "
+            "WHERE constraint_type IN ('PRIMARY KEY', 'UNIQUE')"
+        ).fetchall()
+
+        self.assertCountEqual(postgres_tables, duckdb_tables)
+        self.assertEqual(
+            [(table, column, nullable, DUCKDB_TYPES[data_type]) for table, column, nullable, data_type in postgres_columns],
+            duckdb_columns
+        )
+
+        key_types = {'p': 'PRIMARY KEY', 'u': 'UNIQUE'}
+        self.assertCountEqual(
+            [(table, key_types[key_type], list(columns)) for table, key_type, columns in postgres_keys],
+            [(table, key_type, list(columns)) for table, key_type, columns in duckdb_keys]
+        )
+
+        # Views are compared by their results for the same underlying data
+        asyncio.run(execute(self.url, INSERT_VIEW_RECORDS))
+        duckdb.execute(INSERT_VIEW_RECORDS)
+        for view in sorted(table for table, table_type in postgres_tables if table_type == 'VIEW'):
+            with self.subTest(view=view):
+                postgres_rows, = asyncio.run(execute(self.url, f'SELECT * FROM {view}'))
+                duckdb_rows = duckdb.execute(f'SELECT * FROM {view}').fetchall()
+                self.assertCountEqual([tuple(row) for row in postgres_rows], duckdb_rows)
@@ -0,0 +1,334 @@
+"""Tests for the ``sketches`` module"""
+
+import asyncio
+from datetime import date
+from unittest import TestCase, IsolatedAsyncioTestCase
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from lmod_ingest.sketches import HyperLogLog, build_sketches, count_distinct, ingest_sketches_to_db, rebuild_sketches_from_db
+from lmod_ingest.utils import fetch_db_url, ingest_data_to_db, parse_log_data
+from . import mock
+
+
+class TestHyperLogLog(TestCase):
+    """Tests for the ``HyperLogLog`` class"""
+
+    def test_known_hash_values(self) -> None:
+        """Test values hash to fixed, known values so stored sketches remain compatible"""
+
+        self.assertEqual(0xcefb3950b4c8b007, HyperLogLog.hash_value('user1'))
+        self.assertEqual(0xf6fc42039fba3776, HyperLogLog.hash_value(1))
+        self.assertEqual(0x36e04931f12bcef1, HyperLogLog.hash_value(2 ** 40))
+        self.assertEqual(0xcb1abf8beff3192f, HyperLogLog.hash_value('é'))
+
+    def test_hash_independent_of_dtype(self) -> None:
+        """Test integral job IDs hash identically regardless of their data type"""
+
+        for value in (1.0, np.int64(1), np.float64(1)):
+            with self.subTest(value=value):
+                self.assertEqual(HyperLogLog.hash_value(1), HyperLogLog.hash_value(value))
+
+        int_sketch, float_sketch = HyperLogLog(), HyperLogLog()
+        int_sketch.update(pd.Series([1, 2, None], dtype=pd.Int64Dtype()))
+        float_sketch.update(pd.Series([1.0, 2.0, None]))
+        self.assertTrue((int_sketch.registers == float_sketch.registers).all())
+
+    def test_empty_estimate(self) -> None:
+        """Test an empty sketch estimates zero distinct values"""
+
+        self.assertEqual(0, HyperLogLog().estimate())
+
+    def test_estimate_within_error(self) -> None:
+        """Test estimates fall within the expected error bounds"""
+
+        for cardinality in (10, 1_000, 100_000):
+            sketch = HyperLogLog()
+            sketch.update(pd.Series(range(cardinality)))
+            self.assertAlmostEqual(cardinality, sketch.estimate(), delta=max(1., .03 * cardinality))
+
+    def test_duplicates_ignored(self) -> None:
+        """Test adding the same values repeatedly does not change the estimate"""
+
+        sketch = HyperLogLog()
+        sketch.update(pd.Series(['user1', 'user2', 'user3']))
+        sketch.update(pd.Series(['user1', 'user2', 'user3']))
+        self.assertEqual(3, sketch.estimate())
+
+    def test_nulls_ignored(self) -> None:
+        """Test null values are not counted"""
+
+        sketch = HyperLogLog()
+        sketch.update(pd.Series([1, None, 2], dtype=pd.Int64Dtype()))
+        self.assertEqual(2, sketch.estimate())
+
+    def test_merge(self) -> None:
+        """Test merged sketches estimate the union of their values"""
+
+        sketch1, sketch2 = HyperLogLog(), HyperLogLog()
+        sketch1.update(pd.Series(range(0, 5000)))
+        sketch2.update(pd.Series(range(2500, 7500)))
+        sketch1.merge(sketch2)
+        self.assertAlmostEqual(7500, sketch1.estimate(), delta=.03 * 7500)
+
+    def test_serialization(self) -> None:
+        """Test sketches are unchanged after a round trip through serialization"""
+
+        sketch = HyperLogLog()
+        sketch.update(pd.Series(range(1000)))
+        restored = HyperLogLog.from_bytes(sketch.to_bytes())
+        self.assertTrue((sketch.registers == restored.registers).all())
+
+
+class TestBuildSketches(TestCase):
+    """Tests for the ``build_sketches`` function"""
+
+    def test_grouped_by_package_version_day(self) -> None:
+        """Test a sketch is built for each package, version, and day"""
+
+        sketches = build_sketches(parse_log_data(mock.TEST_PATH))
+        self.assertEqual(2, len(sketches))
+
+        gcc = next(sketch for sketch in sketches if sketch['package'] == 'gcc')
+        self.assertEqual('8.2.0', gcc['version'])
+        self.assertEqual(date(2023, 4, 25), gcc['day'])
+        self.assertEqual(1, gcc['users'].estimate())
+        self.assertEqual(1, gcc['jobs'].estimate())
+
+        openmpi = next(sketch for sketch in sketches if sketch['package'] == 'openmpi')
+        self.assertIsNone(openmpi['version'])
+        self.assertEqual(1, openmpi['users'].estimate())
+        self.assertEqual(0, openmpi['jobs'].estimate())
+
+
+class TestSketchIngestion(IsolatedAsyncioTestCase):
+    """Tests for the ``ingest_sketches_to_db`` function"""
+
+    async def asyncSetUp(self) -> None:
+        """Create temporary tables to run tests against"""
+
+        self.engine = create_async_engine(fetch_db_url())
+        metadata = sa.MetaData()
+        self.sketch_table = sa.Table(
+            'test_sketches', metadata,
+            sa.Column('package', sa.String(100), nullable=False),
+            sa.Column('version', sa.String(150), nullable=True),
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('users', sa.LargeBinary(), nullable=False),
+            sa.Column('jobs', sa.LargeBinary(), nullable=False),
+            sa.UniqueConstraint('package', 'version', 'day', name='unq_load_sketch', postgresql_nulls_not_distinct=True)
+        )
+
+        async with self.engine.connect() as connection:
+            await connection.execute(sa.schema.DropTable(self.sketch_table, if_exists=True))
+            await connection.execute(sa.schema.CreateTable(self.sketch_table))
+            await connection.commit()
+
+    async def asyncTearDown(self) -> None:
+        """Teardown database constructs"""
+
+        async with self.engine.connect() as connection:
+            await connection.execute(sa.schema.DropTable(self.sketch_table, if_exists=True))
+            await connection.commit()
+
+    async def test_repeated_ingestion(self) -> None:
+        """Test ingesting the same data multiple times does not create duplicate sketches"""
+
+        data = parse_log_data(mock.TEST_PATH)
+        async with self.engine.connect() as connection:
+            await ingest_sketches_to_db(data, connection, self.sketch_table.name)
+            await ingest_sketches_to_db(data, connection, self.sketch_table.name)
+
+        async with self.engine.connect() as connection:
+            result = await connection.execute(sa.select(sa.func.count()).select_from(self.sketch_table))
+            self.assertEqual(2, result.scalar_one())
+
+    async def test_empty_data(self) -> None:
+        """Test empty data frames are handled without error"""
+
+        async with self.engine.connect() as connection:
+            await ingest_sketches_to_db(pd.DataFrame(), connection, self.sketch_table.name)
+            result = await connection.execute(sa.select(self.sketch_table))
+            self.assertIsNone(result.scalar_one_or_none())
+
+    async def test_null_and_empty_versions(self) -> None:
+        """Test sketches for null and empty package versions are stored separately"""
+
+        data = parse_log_data(mock.TEST_PATH).iloc[[0, 0]].assign(user=['user1', 'user2'], version=[None, ''])
+        async with self.engine.connect() as connection:
+            await ingest_sketches_to_db(data, connection, self.sketch_table.name)
+            await ingest_sketches_to_db(data, connection, self.sketch_table.name)
+
+        async with self.engine.connect() as connection:
+            rows = (await connection.execute(sa.select(self.sketch_table).order_by(self.sketch_table.c.version))).all()
+
+        self.assertEqual(['', None], [row.version for row in rows])
+        self.assertEqual([1, 1], [HyperLogLog.from_bytes(row.users).estimate() for row in rows])
+
+    async def test_concurrent_ingestion(self) -> None:
+        """Test concurrent ingestions into a new sketch are merged instead of overwritten"""
+
+        data = parse_log_data(mock.TEST_PATH).iloc[[0]]
+        other_data = data.assign(user='user3', jobid=2)
+
+        async def ingest(frame: pd.DataFrame) -> None:
+            async with self.engine.connect() as connection:
+                await ingest_sketches_to_db(frame, connection, self.sketch_table.name)
+
+        await asyncio.gather(ingest(data), ingest(other_data))
+
+        async with self.engine.connect() as connection:
+            row = (await connection.execute(sa.select(self.sketch_table))).one()
+
+        self.assertEqual(2, HyperLogLog.from_bytes(row.users).estimate())
+        self.assertEqual(2, HyperLogLog.from_bytes(row.jobs).estimate())
+
+
+class TestCountDistinct(IsolatedAsyncioTestCase):
+    """Tests for the ``count_distinct`` function"""
+
+    async def asyncSetUp(self) -> None:
+        """Create and populate temporary tables to run tests against"""
+
+        self.engine = create_async_engine(fetch_db_url())
+        metadata = sa.MetaData()
+        self.log_table = sa.Table(
+            'test_log_data', metadata,
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('time', sa.DateTime(), nullable=False),
+            sa.Column('user', sa.String(50), nullable=False),
+            sa.Column('package', sa.String(100), nullable=False),
+            sa.Column('version', sa.String(150), nullable=True),
+            sa.Column('jobid', sa.BigInteger(), nullable=True)
+        )
+
+        self.sketch_table = sa.Table(
+            'test_sketches', metadata,
+            sa.Column('package', sa.String(100), nullable=False),
+            sa.Column('version', sa.String(150), nullable=True),
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('users', sa.LargeBinary(), nullable=False),
+            sa.Column('jobs', sa.LargeBinary(), nullable=False),
+            sa.UniqueConstraint('package', 'version', 'day', name='unq_load_sketch', postgresql_nulls_not_distinct=True)
+        )
+
+        async with self.engine.connect() as connection:
+            for table in (self.log_table, self.sketch_table):
+                await connection.execute(sa.schema.DropTable(table, if_exists=True))
+                await connection.execute(sa.schema.CreateTable(table))
+
+            await connection.commit()
+
+        # Users 0-9 load version 1.0 on Jan 1 and users 5-14 load version 2.0 on Jan 2
+        # Job IDs are unique to each record, except the final record which has no job ID
+        self.data = pd.DataFrame({
+            'time': pd.to_datetime(['2023-01-01 12:00'] * 10 + ['2023-01-02 12:00'] * 10),
+            'user': [f'user{i}' for i in range(10)] + [f'user{i}' for i in range(5, 15)],
+            'package': 'gcc',
+            'version': ['1.0'] * 10 + ['2.0'] * 10,
+            'jobid': pd.array(list(range(19)) + [None], dtype=pd.Int64Dtype())
+        })
+
+        async with self.engine.connect() as connection:
+            await ingest_data_to_db(self.data, self.log_table.name, connection)
+            await ingest_sketches_to_db(self.data, connection, self.sketch_table.name)
+
+    async def asyncTearDown(self) -> None:
+        """Teardown database constructs"""
+
+        async with self.engine.connect() as connection:
+            for table in (self.log_table, self.sketch_table):
+                await connection.execute(sa.schema.DropTable(table, if_exists=True))
+
+            await connection.commit()
+
+    async def count(self, **kwargs) -> dict[str, int]:
+        """Count distinct values against the temporary tables
+
+        Args:
+            **kwargs: Arguments passed to the ``count_distinct`` function
+
+        Returns:
+            The distinct value counts
+        """
+
+        async with self.engine.connect() as connection:
+            return await count_distinct(
+                connection, log_table=self.log_table.name, sketch_table=self.sketch_table.name, **kwargs)
+
+    async def test_exact_counts(self) -> None:
+        """Test exact counts are calculated from the raw log data"""
+
+        self.assertEqual({'users': 15, 'jobs': 19}, await self.count(package='gcc', exact=True))
+
+    async def test_estimates_match_exact_counts(self) -> None:
+        """Test estimated counts match exact counts for small data sets"""
+
+        for kwargs in (
+            {},
+            {'version': '1.0'},
+            {'version': '2.0'},
+            {'start': date(2023, 1, 2)},
+            {'end': date(2023, 1, 2)},
+            {'start': date(2023, 1, 1), 'end': date(2023, 1, 3)},
+        ):
+            with self.subTest(**kwargs):
+                exact = await self.count(package='gcc', exact=True, **kwargs)
+                estimate = await self.count(package='gcc', **kwargs)
+                self.assertEqual(exact, estimate)
+
+    async def test_rebuilt_sketches_match_exact_counts(self) -> None:
+        """Test sketches rebuilt from existing log data match exact counts"""
+
+        async with self.engine.connect() as connection:
+            await connection.execute(sa.delete(self.sketch_table))
+            await connection.commit()
+
+            # Rebuild twice to ensure repeated rebuilds do not inflate the estimates
+            for _ in range(2):
+                await rebuild_sketches_from_db(
+                    connection, batch_size=7, batch_delay=0,
+                    log_table=self.log_table.name, sketch_table=self.sketch_table.name)
+
+        for kwargs in ({}, {'version': '2.0'}, {'start': date(2023, 1, 1), 'end': date(2023, 1, 2)}):
+            with self.subTest(**kwargs):
+                exact = await self.count(package='gcc', exact=True, **kwargs)
+                estimate = await self.count(package='gcc', **kwargs)
+                self.assertEqual(exact, estimate)
+
+    async def test_rebuild_empty_table(self) -> None:
+        """Test rebuilding sketches from an empty table has no effect"""
+
+        async with self.engine.connect() as connection:
+            await connection.execute(sa.delete(self.log_table))
+            await connection.execute(sa.delete(self.sketch_table))
+            await connection.commit()
+            await rebuild_sketches_from_db(
+                connection, batch_size=7, batch_delay=0,
+                log_table=self.log_table.name, sketch_table=self.sketch_table.name)
+
+        self.assertEqual({'users': 0, 'jobs': 0}, await self.count(package='gcc'))
+
+    async def test_version_filter(self) -> None:
+        """Test counts are limited to the given package version"""
+
+        for exact in (True, False):
+            self.assertEqual({'users': 10, 'jobs': 10}, await self.count(package='gcc', version='1.0', exact=exact))
+            self.assertEqual({'users': 10, 'jobs': 9}, await self.count(package='gcc', version='2.0', exact=exact))
+
+    async def test_date_filter(self) -> None:
+        """Test counts are limited to the given date range with an exclusive end date"""
+
+        for exact in (True, False):
+            self.assertEqual({'users': 10, 'jobs': 10}, await self.count(package='gcc', end=date(2023, 1, 2), exact=exact))
+            self.assertEqual({'users': 10, 'jobs': 9}, await self.count(package='gcc', start=date(2023, 1, 2), exact=exact))
+            self.assertEqual({'users': 0, 'jobs': 0}, await self.count(package='gcc', start=date(2023, 1, 3), exact=exact))
+
+    async def test_unknown_package(self) -> None:
+        """Test counts are zero for packages with no records"""
+
+        for exact in (True, False):
+            self.assertEqual({'users': 0, 'jobs': 0}, await self.count(package='fake', exact=exact))